@@ -1,23 +1,26 @@
+import importlib
+
 from .motor import Motor
 from .robot import Robot
 
-# Optional imports - fail gracefully if dependencies missing
-try:
-    from .camera import Camera
-except ImportError:
-    pass
-
-try:
-    from .heartbeat import Heartbeat
-except ImportError:
-    pass
+# Optional imports - loaded on first access so scripts that only need Robot
+# don't pay for camera/torch imports. Missing dependencies make the name
+# unavailable, as before.
+_LAZY_IMPORTS = {
+    'Camera': '.camera',
+    'Heartbeat': '.heartbeat',
+    'bgr8_to_jpeg': '.image',
+    'ObjectDetector': '.object_detection',
+}
 
-try:
-    from .image import bgr8_to_jpeg
-except ImportError:
-    pass
 
-try:
-    from .object_detection import ObjectDetector
-except ImportError:
-    pass
\ No newline at end of file
+def __getattr__(name):
+    if name in _LAZY_IMPORTS:
+        try:
+            module = importlib.import_module(_LAZY_IMPORTS[name], __name__)
+        except ImportError as e:
+            raise AttributeError(f"module {__name__!r} has no attribute {name!r} ({e})") from e
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
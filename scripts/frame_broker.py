@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Camera frame broker for JetBot.
+
+Argus only allows one client per camera sensor, so scripts that each open
+nvarguscamerasrc can't run at the same time. This script runs the single
+camera pipeline and publishes every encoded JPEG frame to all processes
+connected to a Unix-domain socket.
+
+Each SOCK_SEQPACKET message is one complete JPEG frame. Frames are sent
+without blocking; a client that falls behind misses frames instead of
+holding up the others.
+
+Usage:
+    sudo python3 frame_broker.py [--socket /run/jetbot/frames.sock]
+
+The default socket lives under /run, so the broker needs root to create
+it. The socket is made connectable by all local users, so gamepad_control.py
+can run as a normal user. To run the broker without root, pass a --socket
+path you can write to and point the clients at it with JETBOT_FRAME_SOCKET.
+
+gamepad_control.py picks up the broker automatically when the socket
+exists (override the path with JETBOT_FRAME_SOCKET).
+
+Requirements:
+- GStreamer Python bindings: sudo apt-get install python3-gi gir1.2-gstreamer-1.0
+"""
+
+import argparse
+import os
+import signal
+import socket
+import threading
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib, Gst
+
+
+DEFAULT_SOCKET = os.environ.get('JETBOT_FRAME_SOCKET', '/run/jetbot/frames.sock')
+
+# Room for a few queued frames per client before frames are dropped for it
+CLIENT_SNDBUF = 1 << 20
+
+# Let clients running as any user connect (connect() needs write permission)
+SOCKET_MODE = 0o666
+
+
+class FrameBroker(object):
+    """Publishes JPEG frames from one camera pipeline to many local clients"""
+
+    def __init__(self, path, width=224, height=224, fps=30, capture_width=1640,
+                 capture_height=1232, quality=85):
+        self.path = path
+        self.clients = set()
+        self.clients_lock = threading.Lock()
+
+        gst_str = (
+            'nvarguscamerasrc '
+            f'! video/x-raw(memory:NVMM),width={capture_width},height={capture_height},'
+            f'framerate={fps}/1,format=NV12 '
+            '! nvvidconv '
+            f'! video/x-raw(memory:NVMM),width={width},height={height},format=I420 '
+            f'! nvjpegenc quality={quality} '
+            '! appsink name=sink emit-signals=true max-buffers=1 drop=true sync=false'
+        )
+        self.pipeline = Gst.parse_launch(gst_str)
+        self.pipeline.get_by_name('sink').connect('new-sample', self._on_new_sample)
+
+        bus = self.pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect('message::eos', self._on_eos)
+        bus.connect('message::error', self._on_error)
+
+        self.mainloop = GLib.MainLoop()
+
+        socket_dir = os.path.dirname(path)
+        if not os.path.isdir(socket_dir):
+            os.makedirs(socket_dir)
+            os.chmod(socket_dir, 0o755)  # Clients must be able to reach the socket
+        if os.path.exists(path):
+            os.unlink(path)  # Stale socket from a previous run
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.server.bind(path)
+        os.chmod(path, SOCKET_MODE)  # bind() applies our (root) umask
+        self.server.listen()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                break  # Server socket closed
+            client.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, CLIENT_SNDBUF)
+            with self.clients_lock:
+                self.clients.add(client)
+
+    def _on_new_sample(self, appsink):
+        sample = appsink.emit('pull-sample')
+        buf = sample.get_buffer()
+        ok, mapinfo = buf.map(Gst.MapFlags.READ)
+        if not ok:
+            return Gst.FlowReturn.OK
+        try:
+            self._publish(mapinfo.data)
+        finally:
+            buf.unmap(mapinfo)
+        return Gst.FlowReturn.OK
+
+    def _publish(self, jpeg):
+        with self.clients_lock:
+            clients = list(self.clients)
+
+        for client in clients:
+            try:
+                client.send(jpeg, socket.MSG_DONTWAIT)
+            except BlockingIOError:
+                pass  # Client is behind, drop this frame for it
+            except OSError:
+                # Client went away
+                with self.clients_lock:
+                    self.clients.discard(client)
+                client.close()
+
+    def start(self):
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        self.pipeline.set_state(Gst.State.PLAYING)
+        self.mainloop.run()
+
+    def stop(self):
+        self.pipeline.set_state(Gst.State.NULL)
+        self.mainloop.quit()
+        self.server.close()
+        with self.clients_lock:
+            for client in self.clients:
+                client.close()
+            self.clients.clear()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _on_eos(self, bus, msg):
+        self.stop()
+
+    def _on_error(self, bus, msg):
+        err, debug = msg.parse_error()
+        print(f"Pipeline error: {err}")
+        self.stop()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--socket', default=DEFAULT_SOCKET)
+    parser.add_argument('--width', type=int, default=224)
+    parser.add_argument('--height', type=int, default=224)
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--capture_width', type=int, default=1640)
+    parser.add_argument('--capture_height', type=int, default=1232)
+    parser.add_argument('--quality', type=int, default=int(os.environ.get('JETBOT_JPEG_QUALITY', '85')))
+    args = parser.parse_args()
+
+    Gst.init(None)
+
+    broker = FrameBroker(
+        args.socket,
+        width=args.width,
+        height=args.height,
+        fps=args.fps,
+        capture_width=args.capture_width,
+        capture_height=args.capture_height,
+        quality=args.quality
+    )
+
+    def shutdown(*args, **kwargs):
+        broker.stop()
+
+    signal.signal(signal.SIGTERM, shutdown)  # shutdown gracefully
+
+    print(f"Publishing camera frames on {args.socket}")
+    try:
+        broker.start()  # will run until EOS / error on GST bus
+    except KeyboardInterrupt:
+        shutdown()
@@ -8,81 +8,284 @@ connected directly to the Jetson Nano.
 Controls:
 - Left stick vertical axis: Left motor
 - Right stick vertical axis: Right motor
-- L1 (left shoulder): Capture photo to ~/training-photos/left/
-- R1 (right shoulder): Capture photo to ~/training-photos/right/
+- L1 (left shoulder): Capture photo to ~/training-photos/left/ (hold to keep capturing)
+- R1 (right shoulder): Capture photo to ~/training-photos/right/ (hold to keep capturing)
 - Start/Options button: Exit
 
 Requirements:
-- pygame library: pip3 install pygame
+- pygame library (2.0.1 or newer): pip3 install pygame
+- GStreamer Python bindings: sudo apt-get install python3-gi gir1.2-gstreamer-1.0
+
+If frame_broker.py is running, photos are taken from its shared camera
+stream instead of opening the camera directly.
+
+The control loop is pinned to its own CPU core (JETBOT_CONTROL_CPU, the
+last core by default) and runs at SCHED_FIFO priority when allowed. That
+needs root or CAP_SYS_NICE, e.g.:
+    sudo setcap cap_sys_nice+ep $(readlink -f $(which python3))
 """
 
 import pygame
 import sys
+import math
 import time
 import os
-import subprocess
-from datetime import datetime
+import socket
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from jetbot import Robot
-import cv2
+import numpy as np
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+# JPEG quality for training photos, override to trade size/quality for speed
+JPEG_QUALITY = int(os.environ.get('JETBOT_JPEG_QUALITY', '85'))
+
+# Photos allowed to wait for the disk before new captures are dropped
+MAX_PENDING_WRITES = 32
+
+# Socket published by frame_broker.py when it owns the camera
+FRAME_SOCKET = os.environ.get('JETBOT_FRAME_SOCKET', '/run/jetbot/frames.sock')
+MAX_FRAME_SIZE = 1 << 20
+
+# Core reserved for the motor control loop; camera and disk threads use the rest
+CONTROL_CPU = int(os.environ.get('JETBOT_CONTROL_CPU', str(os.cpu_count() - 1)))
+
+
+def _keep_off_control_cpu():
+    """Run the calling thread at normal priority on the non-control cores"""
+    cpus = set(range(os.cpu_count())) - {CONTROL_CPU}
+    try:
+        if cpus:
+            os.sched_setaffinity(0, cpus)
+        os.sched_setscheduler(0, os.SCHED_OTHER, os.sched_param(0))
+    except OSError:
+        pass
+
+
+def _make_realtime():
+    """Pin the calling thread to the control core at SCHED_FIFO priority
+
+    Returns False if the scheduling policy couldn't be raised.
+    """
+    try:
+        os.sched_setaffinity(0, {CONTROL_CPU})
+    except OSError:
+        pass
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(50))
+        return True
+    except OSError:
+        return False
+
+
+def _write_file(filename, data):
+    """Write a captured JPEG to disk"""
+    try:
+        # Buffered write() keeps writing until all the data is out; a JPEG
+        # larger than the buffer goes straight to the file without a copy
+        with open(filename, 'wb') as f:
+            f.write(data)
+            f.flush()
+            # Deliberately synchronous: a photo is on the SD card before it
+            # counts, and clean pages are what FADV_DONTNEED can drop. This
+            # runs on a writer thread, not the control loop.
+            os.fdatasync(f.fileno())
+            if hasattr(os, 'posix_fadvise'):
+                # Training photos aren't read back by this script
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    except OSError as e:
+        print(f"\nFailed to save {filename}: {e}")
+        try:
+            os.unlink(filename)  # Don't leave a truncated JPEG behind
+        except OSError:
+            pass
 
 
 class GStreamerCamera:
     """Persistent GStreamer camera that stays open for fast captures"""
     def __init__(self):
-        self.process = None
-        self.last_capture_time = 0
-        self.min_capture_interval = 0.5  # Minimum time between captures in seconds
+        self.pipeline = None
+        self.sink = None
+        # Disk writes run here so a slow SD card never stalls the camera
+        # or the control loop
+        self.pool = ThreadPoolExecutor(max_workers=4, initializer=_keep_off_control_cpu)
+        self._pending_writes = threading.BoundedSemaphore(MAX_PENDING_WRITES)
 
     def start(self):
-        """Start the camera process"""
-        # Use a simple v4l2 pipeline that's more reliable
-        gst_cmd = [
-            'gst-launch-1.0', '-q',
-            'nvarguscamerasrc',
-            '!', 'video/x-raw(memory:NVMM),width=1640,height=1232,framerate=30/1,format=NV12',
-            '!', 'nvvidconv',
-            '!', 'video/x-raw,width=224,height=224',
-            '!', 'identity', 'name=snapshot',
-            '!', 'fakesink'
-        ]
+        """Start the camera pipeline"""
+        # Keep one pipeline alive and tap encoded frames from an appsink, so
+        # captures don't pay for Argus/encoder initialization every time.
+        # Frames stay in NVMM until nvjpegenc; only the JPEG reaches sysmem.
+        gst_str = (
+            'nvarguscamerasrc '
+            '! video/x-raw(memory:NVMM),width=1640,height=1232,framerate=30/1,format=NV12 '
+            '! nvvidconv '
+            '! video/x-raw(memory:NVMM),width=224,height=224,format=I420 '
+            f'! nvjpegenc quality={JPEG_QUALITY} '
+            '! appsink name=sink emit-signals=false max-buffers=1 drop=true sync=false'
+        )
         try:
-            # Start a persistent pipeline
-            self.process = subprocess.Popen(gst_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            Gst.init(None)
+            self.pipeline = Gst.parse_launch(gst_str)
+            self.sink = self.pipeline.get_by_name('sink')
+            if self.pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+                return False
             time.sleep(1)  # Give it time to initialize
             return True
         except:
             return False
 
-    def capture(self, filename):
-        """Capture a single frame to file"""
-        current_time = time.time()
-        if current_time - self.last_capture_time < self.min_capture_interval:
+    def _pull_jpeg(self, timeout):
+        """Pull the next encoded frame from the appsink, or None on timeout"""
+        sample = self.sink.emit('try-pull-sample', timeout)
+        if sample is None:
+            return None
+
+        buf = sample.get_buffer()
+        ok, mapinfo = buf.map(Gst.MapFlags.READ)
+        if not ok:
+            return None
+        try:
+            return bytes(mapinfo.data)
+        finally:
+            buf.unmap(mapinfo)
+
+    def _save(self, filename, data):
+        """Queue a JPEG for writing, returns False if the write queue is full"""
+        if not self._pending_writes.acquire(blocking=False):
+            return False
+        future = self.pool.submit(_write_file, filename, data)
+        future.add_done_callback(lambda _: self._pending_writes.release())
+        return True
+
+    def capture(self, filename, timeout=100 * Gst.MSECOND):
+        """Capture a single frame to file, written in the background
+
+        A timeout of 0 only takes a frame if one is already waiting.
+        """
+        data = self._pull_jpeg(timeout)
+        if data is None:
             return False
+        return self._save(filename, data)
+
+    def capture_burst(self, count, outdir, prefix, timeout=100 * Gst.MSECOND):
+        """Capture up to count successive frames, returns the number captured
+
+        Files are named <prefix>_<i>.jpg and written in the background.
+        A timeout of 0 only takes a frame if one is already waiting.
+        """
+        captured = 0
+        path_prefix = os.path.join(outdir, prefix)
+        for i in range(count):
+            data = self._pull_jpeg(timeout)
+            if data is None or not self._save(f'{path_prefix}_{i}.jpg', data):
+                break
+            captured += 1
+        return captured
 
-        gst_cmd = [
-            'gst-launch-1.0', '-q',
-            'nvarguscamerasrc', 'num-buffers=1',
-            '!', 'video/x-raw(memory:NVMM),width=1640,height=1232,framerate=30/1',
-            '!', 'nvvidconv',
-            '!', 'video/x-raw,width=224,height=224',
-            '!', 'jpegenc',
-            '!', 'filesink', f'location={filename}'
-        ]
+    def stop(self):
+        """Stop the camera pipeline"""
+        if self.pipeline:
+            self.pipeline.set_state(Gst.State.NULL)
+            self.pipeline = None
+        self.pool.shutdown(wait=True)
+
+
+class FrameBrokerCamera(GStreamerCamera):
+    """Camera that reads JPEG frames published by frame_broker.py"""
+    def __init__(self, path=FRAME_SOCKET):
+        super().__init__()
+        self.path = path
+        self.sock = None
+        # Newest frame not yet taken by a capture; the reader thread keeps
+        # replacing it so captures never see a frame that queued up
+        self._frame = None
+        self._frame_cond = threading.Condition()
+        self._connected = False
+        self._reader = None
+
+    def start(self):
+        """Connect to the frame broker"""
         try:
-            result = subprocess.run(gst_cmd, capture_output=True, timeout=3, check=True)
-            self.last_capture_time = current_time
-            return True
-        except:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            self.sock.connect(self.path)
+        except OSError:
             return False
+        self._connected = True
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+        return True
+
+    def _read_loop(self):
+        """Receive every published frame, keeping only the newest"""
+        _keep_off_control_cpu()
+        while True:
+            try:
+                data = self.sock.recv(MAX_FRAME_SIZE)
+            except OSError:
+                data = b''
+            with self._frame_cond:
+                if not data:
+                    # Empty message means the broker went away (or stop())
+                    was_connected, self._connected = self._connected, False
+                    self._frame_cond.notify_all()
+                    break
+                self._frame = data
+                self._frame_cond.notify_all()
+        if was_connected:
+            print("\nFrame broker disconnected, photo capture unavailable")
+
+    def _pull_jpeg(self, timeout):
+        """Take the newest published frame, or None on timeout
+
+        Like the appsink, each frame is returned once; a timeout of 0 only
+        takes a frame that has already arrived. Once the broker goes away
+        this always returns None.
+        """
+        with self._frame_cond:
+            if self._frame is None and timeout > 0:
+                self._frame_cond.wait_for(lambda: self._frame is not None or not self._connected,
+                                          timeout / Gst.SECOND)
+            data, self._frame = self._frame, None
+        return data
 
     def stop(self):
-        """Stop the camera process"""
-        if self.process:
-            self.process.terminate()
+        """Disconnect from the frame broker"""
+        if self.sock:
+            with self._frame_cond:
+                self._connected = False
             try:
-                self.process.wait(timeout=2)
-            except:
-                self.process.kill()
+                self.sock.shutdown(socket.SHUT_RDWR)  # Wakes the reader
+            except OSError:
+                pass
+            if self._reader:
+                self._reader.join(timeout=1)
+            self.sock.close()
+            self.sock = None
+        super().stop()
+
+
+class PhotoNamer:
+    """Generates photo filenames like left_YYYYMMDD_HHMMSS_NNNNNN.jpg
+
+    Same scheme as gamepad_control_web.py, which lists the shared photo
+    directories newest-first by name. The date is formatted at most once
+    per second; a running counter keeps names unique and in order.
+    """
+    def __init__(self):
+        self._seq = itertools.count()
+        self._second = None
+        self._prefix = None
+
+    def next(self, side):
+        now = int(time.time())
+        if now != self._second:
+            self._second = now
+            self._prefix = time.strftime("%Y%m%d_%H%M%S", time.localtime(now))
+        return f"{side}_{self._prefix}_{next(self._seq):06d}.jpg"
 
 
 def main():
@@ -105,8 +308,8 @@ def main():
     print("\nControls:")
     print("  Left stick (vertical): Left motor")
     print("  Right stick (vertical): Right motor")
-    print("  L1 (left shoulder): Capture photo to ~/training-photos/left/")
-    print("  R1 (right shoulder): Capture photo to ~/training-photos/right/")
+    print("  L1 (left shoulder): Capture photo to ~/training-photos/left/ (hold to keep capturing)")
+    print("  R1 (right shoulder): Capture photo to ~/training-photos/right/ (hold to keep capturing)")
     print("  Start/Options button: Exit")
     print("\nReady to control robot. Press Ctrl+C or Start button to exit.\n")
 
@@ -116,16 +319,38 @@ def main():
     # Ensure motors are stopped on startup
     robot.stop()
 
+    # Camera threads inherit this thread's affinity, keep them off the
+    # control core
+    _keep_off_control_cpu()
+
     # Initialize camera
     print("Initializing camera...")
-    camera = GStreamerCamera()
-    camera_available = camera.start()
+    camera = None
+    camera_available = False
+    if os.path.exists(FRAME_SOCKET):
+        camera = FrameBrokerCamera()
+        source = f"frame broker at {FRAME_SOCKET}"
+        camera_available = camera.start()
+        if not camera_available:
+            # Most likely a stale socket left behind by a killed broker
+            print(f"Frame broker at {FRAME_SOCKET} not responding, opening the camera directly")
+            camera.stop()
+    if not camera_available:
+        camera = GStreamerCamera()
+        source = "GStreamer"
+        camera_available = camera.start()
     if camera_available:
-        print("Camera initialized (using GStreamer)")
+        print(f"Camera initialized (using {source})")
     else:
         print("Warning: Camera not available. Photo capture will be disabled.")
         camera = None
 
+    # Give the control loop its own core and real-time priority
+    if _make_realtime():
+        print(f"Control loop running at SCHED_FIFO priority on CPU {CONTROL_CPU}")
+    else:
+        print(f"Control loop pinned to CPU {CONTROL_CPU} (SCHED_FIFO needs CAP_SYS_NICE)")
+
     # Create photo directories
     photo_base_dir = os.path.expanduser("~/training-photos")
     left_dir = os.path.join(photo_base_dir, "left")
@@ -137,73 +362,134 @@ def main():
     # Photo counters
     left_count = 0
     right_count = 0
+    photo_names = PhotoNamer()
 
     # Deadzone to prevent drift from centered sticks
-    DEADZONE = 0.1
+    DEADZONE = np.float32(0.1)
+    axes = np.empty(2, dtype=np.float32)  # [left, right] stick values
+
+    # Last values sent to the motor driver
+    MOTOR_EPSILON = 1e-3
+    prev_left, prev_right = None, None
+
+    # Motor updates run on absolute ~60 Hz deadlines, so the loop body's
+    # own runtime doesn't stretch the period
+    CONTROL_PERIOD = 1 / 60
+
+    # Holding L1/R1 past HOLD_DELAY keeps capturing every HOLD_INTERVAL, so
+    # a normal tap still saves exactly one photo. Maps each held shoulder
+    # button to when its next repeat capture is due.
+    HOLD_DELAY = 0.4
+    HOLD_INTERVAL = 0.1
+    hold_due = {}
+
+    # Pending debug line and when it was last written
+    STATUS_INTERVAL = 0.1
+    status_line = None
+    last_print = 0.0
 
     # Control loop
     running = True
+    dirty = True  # Axes moved since the last motor update
+    deadline = time.monotonic() + CONTROL_PERIOD
     try:
         while running:
-            # Update joystick state
-            pygame.event.pump()
-            # Process pygame events
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    running = False
-                elif event.type == pygame.JOYBUTTONDOWN:
-                    # Button 4: L1 (left shoulder)
-                    if event.button == 4:
-                        if camera_available:
-                            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-                            filename = os.path.join(left_dir, f"left_{timestamp}.jpg")
-                            if camera.capture(filename):
-                                left_count += 1
-                                print(f"\n[LEFT] Photo saved: {filename} (Total: {left_count})")
-                            else:
-                                print("\n[LEFT] Too fast - wait 0.5s between photos")
+            # Sleep in SDL until an event arrives or the next tick is due
+            timeout_ms = math.ceil((deadline - time.monotonic()) * 1000)
+            # wait(0) would block forever, so just poll once the tick is due
+            event = pygame.event.wait(timeout_ms) if timeout_ms > 0 else pygame.event.poll()
+
+            now = time.monotonic()
+            tick = now >= deadline
+            if tick:
+                deadline += CONTROL_PERIOD
+                if deadline <= now:  # Fell behind, restart the schedule
+                    deadline = now + CONTROL_PERIOD
+
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.JOYAXISMOTION:
+                dirty = True
+            elif event.type == pygame.JOYBUTTONUP:
+                hold_due.pop(event.button, None)
+            elif event.type == pygame.JOYBUTTONDOWN:
+                if event.button in (4, 5):
+                    hold_due[event.button] = now + HOLD_DELAY
+
+                # Button 4: L1 (left shoulder)
+                if event.button == 4:
+                    if camera_available:
+                        filename = os.path.join(left_dir, photo_names.next('left'))
+                        if camera.capture(filename):
+                            left_count += 1
+                            print(f"\n[LEFT] Photo saved: {filename} (Total: {left_count})")
                         else:
-                            print("\n[LEFT] Camera not available - cannot capture photo")
-
-                    # Button 5: R1 (right shoulder)
-                    elif event.button == 5:
-                        if camera_available:
-                            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-                            filename = os.path.join(right_dir, f"right_{timestamp}.jpg")
-                            if camera.capture(filename):
-                                right_count += 1
-                                print(f"\n[RIGHT] Photo saved: {filename} (Total: {right_count})")
-                            else:
-                                print("\n[RIGHT] Too fast - wait 0.5s between photos")
+                            print("\n[LEFT] No frame available from camera")
+                    else:
+                        print("\n[LEFT] Camera not available - cannot capture photo")
+
+                # Button 5: R1 (right shoulder)
+                elif event.button == 5:
+                    if camera_available:
+                        filename = os.path.join(right_dir, photo_names.next('right'))
+                        if camera.capture(filename):
+                            right_count += 1
+                            print(f"\n[RIGHT] Photo saved: {filename} (Total: {right_count})")
                         else:
-                            print("\n[RIGHT] Camera not available - cannot capture photo")
+                            print("\n[RIGHT] No frame available from camera")
+                    else:
+                        print("\n[RIGHT] Camera not available - cannot capture photo")
 
-                    # Button 7: Start/Options button
-                    elif event.button == 7:
-                        print("\nStart button pressed. Exiting...")
-                        running = False
+                # Button 7: Start/Options button
+                elif event.button == 7:
+                    print("\nStart button pressed. Exiting...")
+                    running = False
+
+            # Keep capturing while L1/R1 is held, taking only frames that are
+            # already waiting so the control loop never blocks on the camera
+            if tick and camera_available and hold_due:
+                if now >= hold_due.get(4, math.inf) and joystick.get_button(4):
+                    hold_due[4] = now + HOLD_INTERVAL
+                    filename = os.path.join(left_dir, photo_names.next('left'))
+                    left_count += camera.capture(filename, timeout=0)
+                if now >= hold_due.get(5, math.inf) and joystick.get_button(5):
+                    hold_due[5] = now + HOLD_INTERVAL
+                    filename = os.path.join(right_dir, photo_names.next('right'))
+                    right_count += camera.capture(filename, timeout=0)
+
+            # Refresh the debug line at most 10 times a second
+            if tick and status_line:
+                if now - last_print >= STATUS_INTERVAL:
+                    sys.stdout.write(status_line)
+                    sys.stdout.flush()
+                    status_line = None
+                    last_print = now
+
+            # Only drive the motors on a tick, and only if the sticks moved
+            if not tick or not dirty:
+                continue
+            dirty = False
 
             # Read joystick axes
             # Axis 1: Left stick vertical (up/down)
             # Axis 5: Right stick vertical (up/down)
-            left_value = -joystick.get_axis(1)  # Inverted to match intuitive control
-            right_value = -joystick.get_axis(5)  # Inverted to match intuitive control
-
-            # Apply deadzone
-            if abs(left_value) < DEADZONE:
-                left_value = 0.0
-            if abs(right_value) < DEADZONE:
-                right_value = 0.0
-
-            # Debug output
-            print(f"\rLeft: {left_value:6.3f}  Right: {right_value:6.3f}  Motor L: {robot.left_motor.value:6.3f}  Motor R: {robot.right_motor.value:6.3f}", end='', flush=True)
-
-            # Set motor values
-            robot.left_motor.value = left_value
-            robot.right_motor.value = right_value
-
-            # Small delay to prevent CPU overuse
-            time.sleep(0.01)
+            axes[0] = -joystick.get_axis(1)  # Inverted to match intuitive control
+            axes[1] = -joystick.get_axis(5)  # Inverted to match intuitive control
+
+            # Apply deadzone to both axes at once
+            axes[np.abs(axes) < DEADZONE] = 0.0
+            left_value, right_value = float(axes[0]), float(axes[1])
+
+            # Set motor values, skipping I2C writes when nothing changed
+            if prev_left is None or abs(left_value - prev_left) > MOTOR_EPSILON:
+                robot.left_motor.value = left_value
+                prev_left = left_value
+            if prev_right is None or abs(right_value - prev_right) > MOTOR_EPSILON:
+                robot.right_motor.value = right_value
+                prev_right = right_value
+
+            # Debug output, written out by the next tick
+            status_line = f"\rLeft: {left_value:6.3f}  Right: {right_value:6.3f}  Motor L: {robot.left_motor.value:6.3f}  Motor R: {robot.right_motor.value:6.3f}"
 
     except KeyboardInterrupt:
         print("\nKeyboard interrupt detected. Stopping robot...")
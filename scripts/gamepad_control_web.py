@@ -15,26 +15,113 @@ Controls:
 Web Interface:
 - http://<jetbot-ip>:5000 - View photos and controller status
 
+At most JETBOT_WEB_MAX_VIEWERS pages (default 4) can stream at once. Each
+open page holds a video feed and a status stream; beyond the limit those
+are refused with 503 (the page then polls for status), so the other
+routes stay responsive.
+
 Requirements:
 - pygame library: pip3 install pygame
+- evdev library (recommended): pip3 install evdev
 - flask library: pip3 install flask
+- waitress library (recommended): pip3 install waitress
+- orjson library (optional): pip3 install orjson
+- numba library (optional): pip3 install numba
 """
 
 import pygame
 import sys
+import math
 import time
 import os
+import fcntl
+import select
 import subprocess
+import collections
+import itertools
 import threading
-from datetime import datetime
+import queue
+import logging
+import logging.handlers
+from concurrent.futures import ThreadPoolExecutor
 from jetbot import Robot
 import cv2
 import numpy as np
-from flask import Flask, render_template, jsonify, send_from_directory, Response
+from flask import Flask, jsonify, send_from_directory, Response
+from werkzeug.wsgi import ClosingIterator
+
+# Optional - read the gamepad through evdev instead of polling pygame
+try:
+    import evdev
+    from evdev import ecodes
+except ImportError:
+    evdev = None
+
+# Optional - faster JSON encoding for the status endpoint
+try:
+    import orjson
+    json_dumps = orjson.dumps
+except ImportError:
+    import json
+
+    def json_dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+# Optional - compile the stick response curve
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+# Stick response curve: 0 is linear, 1 is fully cubic
+AXIS_EXPO = float(os.environ.get('JETBOT_AXIS_EXPO', '0'))
+
+
+@njit(cache=True)
+def shape_axis(v, dz, expo):
+    """Apply deadzone and expo to a stick value, rescaled to [-1, 1]"""
+    if abs(v) < dz:
+        return 0.0
+    s = (abs(v) - dz) / (1.0 - dz)
+    return math.copysign(s * (1.0 - expo) + s ** 3 * expo, v)
+
+
+shape_axis(0.5, 0.1, AXIS_EXPO)  # Compile now rather than in the control loop
+
+
+class StateDict(dict):
+    """Status dict that flags when any field changes"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.changed = threading.Event()
+
+    def __setitem__(self, key, value):
+        if key not in self or self[key] != value:
+            super().__setitem__(key, value)
+            self.changed.set()
+
+
+# Messages from the camera, writer and control threads go through a queue
+# and are written out by a listener thread, so they never block on stderr
+logger = logging.getLogger('gamepad_control_web')
+LOG_LEVEL = os.environ.get('JETBOT_LOG_LEVEL', 'INFO').upper()
+
+
+def _start_logging():
+    """Route logger output through a background thread, returns the listener"""
+    log_queue = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler(sys.stderr))
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+    listener.start()
+    return listener
+
 
 # Global state
 app = Flask(__name__)
-state = {
+state = StateDict({
     'running': False,
     'camera_available': False,
     'gamepad_connected': False,
@@ -48,7 +135,16 @@ state = {
     'last_photo': None,
     'last_photo_side': None,
     'message': ''
-}
+})
+
+# Serialized state served by /api/status, refreshed by state_encoder_loop
+state_bytes = json_dumps(dict(state))
+STATE_ENCODE_INTERVAL = 0.1  # Re-encode at most 10 times a second
+
+# Bumped with every new state_bytes to wake /api/status/stream clients
+state_seq = 0
+state_cond = threading.Condition()
+STATE_KEEPALIVE_INTERVAL = 5.0  # Comment line sent to idle stream clients
 
 photo_base_dir = os.path.expanduser("~/training-photos")
 left_dir = os.path.join(photo_base_dir, "left")
@@ -57,45 +153,151 @@ right_dir = os.path.join(photo_base_dir, "right")
 # Global camera reference for video feed
 global_camera = None
 
+# Multipart framing around each JPEG in the /video_feed stream
+MJPEG_HDR = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+MJPEG_TAIL = b'\r\n'
+
+# A video feed that has no frame to send within this long ends, so it
+# doesn't hold a server thread while no camera is running
+VIDEO_START_TIMEOUT = 5.0
+
+# waitress worker threads. Every open page holds two for as long as it is
+# open (video feed and status stream); the rest serve ordinary requests.
+# Streams beyond MAX_VIEWERS are refused so they can't use up the pool.
+MAX_VIEWERS = int(os.environ.get('JETBOT_WEB_MAX_VIEWERS', '4'))
+WEB_THREADS = 2 * MAX_VIEWERS + 4
+video_feed_slots = threading.BoundedSemaphore(MAX_VIEWERS)
+status_stream_slots = threading.BoundedSemaphore(MAX_VIEWERS)
+
+# Output buffered per connection before waitress blocks the response. The
+# default (16 MiB) would queue hundreds of video frames for a slow client;
+# a few frames' worth makes it wait, so it skips to the newest frame.
+WEB_OUTBUF_HIGH_WATERMARK = 256 * 1024
+
+# cv2 encoder settings when the hardware JPEG encoder isn't available
+FEED_JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, 80]
+SNAPSHOT_JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, 95]
+
+# fcntl.F_SETPIPE_SZ is only exported from Python 3.10
+F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+
+# Photo filenames per side, newest first. Scanned once at startup and then
+# kept up to date by capture and delete, so listing needs no disk access.
+photos = {'left': collections.deque(), 'right': collections.deque()}
+photos_lock = threading.Lock()
+
+
+def _scan_photos(photo_dir):
+    """List the photos in a directory, newest first"""
+    with os.scandir(photo_dir) as it:
+        names = [entry.name for entry in it if entry.name.endswith('.jpg')]
+    names.sort(reverse=True)
+    return names
+
+
+def _load_photos(side, photo_dir):
+    """Rebuild the photo list for a side from disk"""
+    with photos_lock:
+        photos[side] = collections.deque(_scan_photos(photo_dir))
+        state[f'{side}_count'] = len(photos[side])
+
+
+def _gst_element_available(name):
+    """Check whether a GStreamer element is installed"""
+    try:
+        result = subprocess.run(['gst-inspect-1.0', name],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return result.returncode == 0
+    except OSError:
+        return False
+
 
 class GStreamerCamera:
     """GStreamer camera using persistent pipeline for low latency"""
     def __init__(self):
         self.last_capture_time = 0
         self.min_capture_interval = 0.5
-        self.latest_frame = None
+        # Double buffer: frames are read into _back, then swapped to _front
+        self._front = np.empty((480, 640, 3), dtype=np.uint8)
+        self._back = np.empty((480, 640, 3), dtype=np.uint8)
+        self._has_frame = False
         self.frame_lock = threading.Lock()
         self.running = False
         self.stream_process = None
+        # Pre-encoded JPEGs of the latest frame from the hardware encoder,
+        # for the video feed and as 224x224 training snapshots
+        self.hw_jpeg = False
+        self.latest_jpeg = None
+        self.latest_snapshot = None
+        # Single writer thread keeps photo writes off the control loop
+        self._writer = ThreadPoolExecutor(max_workers=1)
+        # Bumped on every new video feed frame; each client remembers the
+        # last one it sent and waits for a newer one, skipping any it missed
+        self.frame_seq = 0
+        self._frame_cond = threading.Condition()
+        # Software-encoded feed JPEG and the frame_seq it was made from,
+        # shared by all video feed clients
+        self._sw_jpeg = (0, None)
 
     def start(self):
         """Start the camera capture thread"""
         try:
             print("Starting camera pipeline...")
 
-            # Start persistent GStreamer pipeline that outputs to stdout
             gst_cmd = [
                 'gst-launch-1.0', '-q',
                 'nvarguscamerasrc', '!',
-                'video/x-raw(memory:NVMM),width=1280,height=720,framerate=30/1', '!',
-                'nvvidconv', '!',
-                'video/x-raw,width=640,height=480', '!',
-                'videoconvert', '!',
-                'video/x-raw,format=BGR', '!',
-                'fdsink'
+                'video/x-raw(memory:NVMM),width=1280,height=720,framerate=30/1', '!'
             ]
 
+            # With the hardware encoder, two branches scale and encode with
+            # nvvidconv/nvjpegenc, each into its own pipe: the video feed and
+            # the 224x224 training snapshots. Nothing needs raw frames then.
+            jpeg_pipes = []
+            if _gst_element_available('nvjpegenc'):
+                gst_cmd += ['tee', 'name=t']
+                for (width, height, quality), on_jpeg in [
+                        ((640, 480, 80), self._on_feed_jpeg),
+                        ((224, 224, 95), self._on_snapshot_jpeg)]:
+                    read_fd, write_fd = os.pipe()
+                    jpeg_pipes.append((read_fd, write_fd, on_jpeg))
+                    gst_cmd += [
+                        't.', '!', 'queue', '!',
+                        'nvvidconv', '!',
+                        f'video/x-raw(memory:NVMM),width={width},height={height},format=I420', '!',
+                        'nvjpegenc', f'quality={quality}', '!',
+                        'multipartmux', 'boundary=frame', '!',
+                        'fdsink', f'fd={write_fd}'
+                    ]
+            else:
+                # Otherwise output BGR frames to stdout and encode on the CPU
+                gst_cmd += [
+                    'nvvidconv', '!',
+                    'video/x-raw,width=640,height=480', '!',
+                    'videoconvert', '!',
+                    'video/x-raw,format=BGR', '!',
+                    'fdsink'
+                ]
+
+            self.hw_jpeg = bool(jpeg_pipes)
             self.stream_process = subprocess.Popen(
                 gst_cmd,
-                stdout=subprocess.PIPE,
+                stdout=subprocess.DEVNULL if self.hw_jpeg else subprocess.PIPE,
                 stderr=subprocess.DEVNULL,
-                bufsize=640*480*3
+                bufsize=0,  # Frames are read straight from the pipe fd
+                pass_fds=[write_fd for _, write_fd, _ in jpeg_pipes]
             )
 
-            # Start frame reading thread
+            # Start frame reading threads
             self.running = True
-            self.capture_thread = threading.Thread(target=self._capture_loop, daemon=True)
-            self.capture_thread.start()
+            if self.hw_jpeg:
+                for read_fd, write_fd, on_jpeg in jpeg_pipes:
+                    os.close(write_fd)  # The pipeline owns the write end now
+                    threading.Thread(target=self._jpeg_loop, args=(read_fd, on_jpeg), daemon=True).start()
+            else:
+                print("nvjpegenc not available, encoding JPEGs on the CPU")
+                self.capture_thread = threading.Thread(target=self._capture_loop, daemon=True)
+                self.capture_thread.start()
 
             time.sleep(1)
             print("Camera pipeline started")
@@ -106,67 +308,210 @@ class GStreamerCamera:
             return False
 
     def _capture_loop(self):
-        """Continuously read frames from GStreamer stdout"""
+        """Continuously read BGR frames from GStreamer stdout
+
+        Only runs without the hardware encoder, to feed the CPU encoder.
+        """
         frame_size = 640 * 480 * 3  # BGR format
+        fd = self.stream_process.stdout.fileno()
+        os.set_blocking(fd, True)
+
+        # Let the pipe hold a whole frame so it drains in fewer reads
+        try:
+            fcntl.fcntl(fd, F_SETPIPE_SZ, frame_size)
+        except OSError:
+            pass
 
         while self.running and self.stream_process:
             try:
-                # Read one frame worth of data
-                raw_frame = self.stream_process.stdout.read(frame_size)
-
-                if len(raw_frame) != frame_size:
-                    continue
-
-                # Convert raw bytes to numpy array
-                frame = np.frombuffer(raw_frame, dtype=np.uint8)
-                frame = frame.reshape((480, 640, 3))
+                # Read one frame straight into the back buffer, resuming
+                # after short reads
+                mv = memoryview(self._back).cast('B')
+                got = 0
+                while got < frame_size:
+                    n = os.readv(fd, [mv[got:]])
+                    if not n:
+                        break
+                    got += n
+
+                if got != frame_size:
+                    break  # Pipeline closed
 
                 with self.frame_lock:
-                    self.latest_frame = frame.copy()
+                    self._front, self._back = self._back, self._front
+                    self._has_frame = True
+
+                self._notify_frame()
 
             except Exception as e:
                 if self.running:
-                    print(f"Frame read error: {e}")
+                    logger.warning("Frame read error: %s", e)
                 break
 
+    def _jpeg_loop(self, fd, on_jpeg):
+        """Continuously read encoded JPEGs from a multipartmux pipe"""
+        with os.fdopen(fd, 'rb') as stream:
+            while self.running:
+                try:
+                    # Each part is a boundary line, headers, a blank line
+                    # and Content-Length bytes of JPEG data
+                    line = stream.readline()
+                    if not line:
+                        break  # Pipeline closed
+                    if not line.startswith(b'--'):
+                        continue
+
+                    length = None
+                    while True:
+                        line = stream.readline()
+                        if line in (b'\r\n', b''):
+                            break
+                        name, _, value = line.partition(b':')
+                        if name.strip().lower() == b'content-length':
+                            length = int(value)
+
+                    if length is None:
+                        continue
+
+                    jpeg = stream.read(length)
+                    if len(jpeg) != length:
+                        break  # Pipeline closed mid-frame
+                    on_jpeg(jpeg)
+
+                except Exception as e:
+                    if self.running:
+                        logger.warning("JPEG read error: %s", e)
+                    break
+
+    def _on_feed_jpeg(self, jpeg):
+        with self._frame_cond:
+            self.latest_jpeg = jpeg
+            self.frame_seq += 1
+            self._frame_cond.notify_all()
+
+    def _on_snapshot_jpeg(self, jpeg):
+        self.latest_snapshot = jpeg
+
+    def _notify_frame(self):
+        """Wake everyone waiting for a new video feed frame"""
+        with self._frame_cond:
+            self.frame_seq += 1
+            self._frame_cond.notify_all()
+
+    def wait_frame(self, seq, timeout=None):
+        """Block until there is a frame newer than seq
+
+        Returns the sequence number of the latest frame, or None on timeout.
+        """
+        with self._frame_cond:
+            if not self._frame_cond.wait_for(lambda: self.frame_seq > seq, timeout):
+                return None
+            return self.frame_seq
+
     def get_frame(self):
-        """Get the latest frame"""
+        """Get the latest frame
+
+        The array is not copied; the capture thread starts overwriting it
+        one frame later, so consume it right away.
+        """
         with self.frame_lock:
-            if self.latest_frame is not None:
-                return self.latest_frame.copy()
+            if self._has_frame:
+                return self._front
         return None
 
-    def capture(self, filename):
-        """Capture current frame to file"""
+    def get_jpeg(self):
+        """Get the latest frame as JPEG bytes"""
+        if self.hw_jpeg:
+            return self.latest_jpeg
+
+        # Encode each frame once, however many clients are watching
+        seq = self.frame_seq
+        cached_seq, jpeg = self._sw_jpeg
+        if cached_seq == seq and jpeg is not None:
+            return jpeg
+
+        frame = self.get_frame()
+        if frame is None:
+            return None
+
+        ret, buffer = cv2.imencode('.jpg', frame, FEED_JPEG_PARAMS)
+        if not ret:
+            return None
+        jpeg = bytes(memoryview(buffer))
+        self._sw_jpeg = (seq, jpeg)
+        return jpeg
+
+    def capture(self, filename, on_saved=None):
+        """Capture current frame to file
+
+        The file is written by a background thread so a slow SD card
+        doesn't stall the caller; on_saved() is called once it is on disk.
+        """
         current_time = time.time()
         if current_time - self.last_capture_time < self.min_capture_interval:
-            print(f"Capture too soon (rate limited)")
+            logger.debug("Capture too soon (rate limited)")
             return False
 
-        frame = self.get_frame()
-        if frame is None:
-            print(f"No frame available for capture")
+        if self.hw_jpeg:
+            # Already scaled and encoded by the pipeline
+            jpeg = self.latest_snapshot
+        else:
+            frame = self.get_frame()
+            jpeg = None
+            if frame is not None:
+                # Resize to 224x224 for training
+                small_frame = cv2.resize(frame, (224, 224))
+                ret, buffer = cv2.imencode('.jpg', small_frame, SNAPSHOT_JPEG_PARAMS)
+                if ret:
+                    jpeg = buffer  # os.write takes the array as-is, no copy
+
+        if jpeg is None:
+            logger.debug("No frame available for capture")
             return False
 
+        self.last_capture_time = current_time
+        self._writer.submit(self._write_jpeg, filename, jpeg, on_saved)
+        return True
+
+    def _write_jpeg(self, filename, jpeg, on_saved):
+        """Write a captured JPEG, runs on the writer thread"""
         try:
-            # Resize to 224x224 for training
-            small_frame = cv2.resize(frame, (224, 224))
-            success = cv2.imwrite(filename, small_frame, [cv2.IMWRITE_JPEG_QUALITY, 95])
-            if success:
-                self.last_capture_time = current_time
-                file_size = os.path.getsize(filename)
-                print(f"Captured {filename}: {file_size} bytes")
-                return True
-            else:
-                print(f"cv2.imwrite failed for {filename}")
-            return False
-        except Exception as e:
-            print(f"Capture error: {e}")
-            return False
+            fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        except OSError as e:
+            logger.error("Capture error: %s", e)
+            return
+
+        try:
+            try:
+                # os.write may write only part of the data (e.g. disk full)
+                view = memoryview(jpeg).cast('B')
+                while view:
+                    view = view[os.write(fd, view):]
+                # Sync before reporting the photo as saved, so it survives a
+                # power cut; it also leaves the pages clean for the hint below
+                os.fdatasync(fd)
+                if hasattr(os, 'posix_fadvise'):
+                    # Keep saved photos from crowding the page cache; a
+                    # 224x224 JPEG is cheap to re-read if the gallery shows it
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            logger.error("Capture error: %s", e)
+            try:
+                os.unlink(filename)  # Don't leave a truncated JPEG behind
+            except OSError:
+                pass
+            return
+
+        logger.debug("Captured %s: %d bytes", filename, len(jpeg))
+        if on_saved is not None:
+            on_saved()
 
     def stop(self):
         """Stop the camera process"""
         self.running = False
+        self._writer.shutdown(wait=True)
         if hasattr(self, 'capture_thread'):
             self.capture_thread.join(timeout=2)
         if self.stream_process:
@@ -177,28 +522,175 @@ class GStreamerCamera:
                 self.stream_process.kill()
 
 
-def robot_control_loop():
-    """Main robot control loop running in separate thread"""
-    global state, global_camera
+class PhotoNamer:
+    """Generates unique, time-ordered photo filenames
+
+    Names look like left_YYYYMMDD_HHMMSS_NNNNNN.jpg. The timestamp part is
+    formatted at most once per second and a running counter keeps names
+    unique within it.
+    """
+    def __init__(self):
+        self._seq = itertools.count()
+        self._second = None
+        self._prefix = None
+
+    def next(self, side):
+        now = int(time.time())
+        if now != self._second:
+            self._second = now
+            self._prefix = time.strftime("%Y%m%d_%H%M%S", time.localtime(now))
+        return f"{side}_{self._prefix}_{next(self._seq):06d}.jpg"
+
+
+class EvdevGamepad:
+    """Gamepad read directly through evdev
+
+    poll() sleeps in the kernel until the device has input. Axis and button
+    numbers follow SDL's ordering, so they match the pygame numbering.
+    """
+    quit_requested = False
+    disconnected = False
+
+    def __init__(self, device):
+        self.device = device
+        caps = device.capabilities()
+
+        # SDL numbers absolute axes in code order, leaving out the hats
+        abs_info = {code: info for code, info in caps.get(ecodes.EV_ABS, [])
+                    if not ecodes.ABS_HAT0X <= code <= ecodes.ABS_HAT3Y}
+        self._axis_index = {code: i for i, code in enumerate(sorted(abs_info))}
+        self._axis_range = {code: (info.min, info.max) for code, info in abs_info.items()}
+        self._axes = [0.0] * len(abs_info)
+        for code, info in abs_info.items():
+            self._set_axis(code, info.value)
+
+        # ...and buttons from BTN_JOYSTICK upwards, then BTN_MISC upwards
+        keys = caps.get(ecodes.EV_KEY, [])
+        buttons = (sorted(k for k in keys if k >= ecodes.BTN_JOYSTICK) +
+                   sorted(k for k in keys if ecodes.BTN_MISC <= k < ecodes.BTN_JOYSTICK))
+        self._button_index = {code: i for i, code in enumerate(buttons)}
+
+    def _set_axis(self, code, value):
+        lo, hi = self._axis_range[code]
+        if hi > lo:
+            self._axes[self._axis_index[code]] = 2.0 * (value - lo) / (hi - lo) - 1.0
+
+    def get_name(self):
+        return self.device.name
+
+    def get_axis(self, axis):
+        return self._axes[axis]
+
+    def poll(self, timeout):
+        """Wait up to timeout seconds for input, returns the buttons pressed"""
+        pressed = []
+        ready, _, _ = select.select([self.device.fd], [], [], timeout)
+        if not ready:
+            return pressed
+
+        try:
+            for event in self.device.read():
+                if event.type == ecodes.EV_ABS and event.code in self._axis_index:
+                    self._set_axis(event.code, event.value)
+                elif event.type == ecodes.EV_KEY and event.value == 1 and event.code in self._button_index:
+                    pressed.append(self._button_index[event.code])
+        except BlockingIOError:
+            pass
+        except OSError:
+            # ENODEV once the controller drops off (e.g. Bluetooth lost)
+            self.disconnected = True
+            self.quit_requested = True
+        return pressed
+
+    def close(self):
+        self.device.close()
+
+
+class PygameGamepad:
+    """Fallback gamepad read through pygame
+
+    SDL is pumped at PUMP_INTERVAL rather than on every poll; button
+    presses queue up in SDL in between, so none are lost.
+    """
+    quit_requested = False
+    disconnected = False
+    PUMP_INTERVAL = 0.05  # 20 Hz, plenty for the robot's command rate
+
+    def __init__(self, joystick):
+        self.joystick = joystick
+        self._last_pump = 0.0
+
+    def get_name(self):
+        return self.joystick.get_name()
+
+    def get_axis(self, axis):
+        return self.joystick.get_axis(axis)
+
+    def poll(self, timeout):
+        """Pump pygame events once the pump interval has passed, returns
+        the buttons pressed"""
+        delay = self._last_pump + self.PUMP_INTERVAL - time.monotonic()
+        if delay > 0:
+            time.sleep(min(delay, timeout))
+        self._last_pump = time.monotonic()
+
+        pressed = []
+        pygame.event.pump()
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                self.quit_requested = True
+            elif event.type == pygame.JOYBUTTONDOWN:
+                pressed.append(event.button)
+        return pressed
+
+    def close(self):
+        pygame.quit()
+
+
+def _is_gamepad(device):
+    """Check whether an evdev device looks like a gamepad or joystick"""
+    caps = device.capabilities(absinfo=False)
+    keys = caps.get(ecodes.EV_KEY, [])
+    return ecodes.EV_ABS in caps and any(ecodes.BTN_JOYSTICK <= k < ecodes.BTN_DIGI for k in keys)
+
+
+def open_gamepad():
+    """Open the first gamepad, using evdev if available and pygame otherwise"""
+    if evdev is not None:
+        device_path = os.environ.get('JETBOT_GAMEPAD_DEVICE')
+        for path in [device_path] if device_path else evdev.list_devices():
+            try:
+                device = evdev.InputDevice(path)
+            except OSError:
+                continue
+            if _is_gamepad(device):
+                return EvdevGamepad(device)
+            device.close()
 
-    # Initialize pygame and joystick
     pygame.init()
     pygame.joystick.init()
-
-    # Check for connected joysticks
     if pygame.joystick.get_count() == 0:
+        return None
+    joystick = pygame.joystick.Joystick(0)
+    joystick.init()
+    return PygameGamepad(joystick)
+
+
+def robot_control_loop():
+    """Main robot control loop running in separate thread"""
+    global state, global_camera
+
+    # Open the gamepad
+    gamepad = open_gamepad()
+    if gamepad is None:
         state['message'] = "No gamepad detected"
         state['gamepad_connected'] = False
         return
 
-    # Initialize the first joystick
-    joystick = pygame.joystick.Joystick(0)
-    joystick.init()
-
     state['gamepad_connected'] = True
-    state['gamepad_name'] = joystick.get_name()
-    state['message'] = f"Gamepad connected: {joystick.get_name()}"
-    print(f"Gamepad connected: {joystick.get_name()}")
+    state['gamepad_name'] = gamepad.get_name()
+    state['message'] = f"Gamepad connected: {gamepad.get_name()}"
+    print(f"Gamepad connected: {gamepad.get_name()}")
 
     # Initialize robot
     robot = Robot()
@@ -218,79 +710,82 @@ def robot_control_loop():
         print("Warning: Camera not available")
         state['message'] = "Gamepad ready, camera unavailable"
 
-    # Create photo directories
-    os.makedirs(left_dir, exist_ok=True)
-    os.makedirs(right_dir, exist_ok=True)
-
-    # Count existing photos
-    left_photos = [f for f in os.listdir(left_dir) if f.endswith('.jpg')]
-    right_photos = [f for f in os.listdir(right_dir) if f.endswith('.jpg')]
-    state['left_count'] = len(left_photos)
-    state['right_count'] = len(right_photos)
-    print(f"Found {len(left_photos)} left photos, {len(right_photos)} right photos")
-
     # Deadzone to prevent drift from centered sticks
     DEADZONE = 0.1
 
+    # Input wait; when no event arrives in time the motor command is re-sent
+    INPUT_TIMEOUT = 0.05
+
+    photo_names = PhotoNamer()
+
+    # Last values sent to the motor driver
+    MOTOR_EPSILON = 0.01
+    last_left = last_right = None
+
+    def needs_write(value, last):
+        """Whether a motor command differs enough from the last one sent
+
+        Stopping always gets written: shape_axis can return values below
+        MOTOR_EPSILON, and the motor must still be commanded back to 0.
+        """
+        if last is None or (value == 0.0) != (last == 0.0):
+            return True
+        return abs(value - last) > MOTOR_EPSILON
+
+    def photo_saved(side, photo):
+        """Record a photo once the writer thread has it on disk"""
+        with photos_lock:
+            photos[side].appendleft(photo)
+            state[f'{side}_count'] = len(photos[side])
+        state['last_photo'] = photo
+        state['last_photo_side'] = side
+        state['message'] = f"{side.upper()} photo saved ({state[f'{side}_count']} total)"
+        logger.info("[%s] Photo saved: %s", side.upper(), photo)
+
+    def handle_button(button):
+        """Handle a gamepad button press"""
+        # Button 4: L1 (left shoulder)
+        if button == 4:
+            if camera_available:
+                photo = photo_names.next('left')
+                if not camera.capture(os.path.join(left_dir, photo), lambda: photo_saved('left', photo)):
+                    state['message'] = "Too fast - wait 0.5s between photos"
+            else:
+                state['message'] = "Camera not available"
+
+        # Button 5: R1 (right shoulder)
+        elif button == 5:
+            if camera_available:
+                photo = photo_names.next('right')
+                if not camera.capture(os.path.join(right_dir, photo), lambda: photo_saved('right', photo)):
+                    state['message'] = "Too fast - wait 0.5s between photos"
+            else:
+                state['message'] = "Camera not available"
+
+        # Button 7: Start/Options button
+        elif button == 7:
+            print("Start button pressed. Exiting...")
+            state['running'] = False
+            state['message'] = "Shutting down..."
+
     # Control loop
     state['running'] = True
     try:
         while state['running']:
-            # Update joystick state
-            pygame.event.pump()
-
-            # Process pygame events
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    state['running'] = False
-                elif event.type == pygame.JOYBUTTONDOWN:
-                    # Button 4: L1 (left shoulder)
-                    if event.button == 4:
-                        if camera_available:
-                            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-                            filename = os.path.join(left_dir, f"left_{timestamp}.jpg")
-                            if camera.capture(filename):
-                                state['left_count'] += 1
-                                state['last_photo'] = f"left_{timestamp}.jpg"
-                                state['last_photo_side'] = 'left'
-                                state['message'] = f"LEFT photo saved ({state['left_count']} total)"
-                                print(f"[LEFT] Photo saved: {filename}")
-                            else:
-                                state['message'] = "Too fast - wait 0.5s between photos"
-                        else:
-                            state['message'] = "Camera not available"
-
-                    # Button 5: R1 (right shoulder)
-                    elif event.button == 5:
-                        if camera_available:
-                            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-                            filename = os.path.join(right_dir, f"right_{timestamp}.jpg")
-                            if camera.capture(filename):
-                                state['right_count'] += 1
-                                state['last_photo'] = f"right_{timestamp}.jpg"
-                                state['last_photo_side'] = 'right'
-                                state['message'] = f"RIGHT photo saved ({state['right_count']} total)"
-                                print(f"[RIGHT] Photo saved: {filename}")
-                            else:
-                                state['message'] = "Too fast - wait 0.5s between photos"
-                        else:
-                            state['message'] = "Camera not available"
-
-                    # Button 7: Start/Options button
-                    elif event.button == 7:
-                        print("Start button pressed. Exiting...")
-                        state['running'] = False
-                        state['message'] = "Shutting down..."
-
-            # Read joystick axes
-            left_value = -joystick.get_axis(1)  # Inverted
-            right_value = -joystick.get_axis(5)  # Inverted
-
-            # Apply deadzone
-            if abs(left_value) < DEADZONE:
-                left_value = 0.0
-            if abs(right_value) < DEADZONE:
-                right_value = 0.0
+            # Wait for gamepad input and handle button presses
+            for button in gamepad.poll(INPUT_TIMEOUT):
+                handle_button(button)
+            if gamepad.disconnected:
+                print("Gamepad disconnected")
+                state['gamepad_connected'] = False
+                state['message'] = "Gamepad disconnected"
+                break  # Axes are stale; stop the motors right away
+            if gamepad.quit_requested:
+                state['running'] = False
+
+            # Read joystick axes through the deadzone and response curve
+            left_value = shape_axis(-gamepad.get_axis(1), DEADZONE, AXIS_EXPO)  # Inverted
+            right_value = shape_axis(-gamepad.get_axis(5), DEADZONE, AXIS_EXPO)  # Inverted
 
             # Update state
             state['left_axis'] = left_value
@@ -298,12 +793,15 @@ def robot_control_loop():
             state['left_motor'] = left_value
             state['right_motor'] = right_value
 
-            # Set motor values
-            robot.left_motor.value = left_value
-            robot.right_motor.value = right_value
-
-            # Small delay
-            time.sleep(0.01)
+            # Set motor values, skipping I2C writes when nothing changed
+            if left_value == right_value == last_left == last_right == 0.0:
+                continue  # Stopped and staying stopped
+            if needs_write(left_value, last_left):
+                robot.left_motor.value = left_value
+                last_left = left_value
+            if needs_write(right_value, last_right):
+                robot.right_motor.value = right_value
+                last_right = right_value
 
     except KeyboardInterrupt:
         print("Keyboard interrupt detected")
@@ -314,22 +812,73 @@ def robot_control_loop():
         robot.stop()
         if camera_available:
             camera.stop()
-        pygame.quit()
+        gamepad.close()
         state['running'] = False
         print("Robot control stopped")
 
 
+def state_encoder_loop():
+    """Re-encode the status JSON whenever the state changes"""
+    global state_bytes, state_seq
+
+    while True:
+        state.changed.wait()
+        state.changed.clear()
+        encoded = json_dumps(dict(state))
+        with state_cond:
+            state_bytes = encoded
+            state_seq += 1
+            state_cond.notify_all()
+        time.sleep(STATE_ENCODE_INTERVAL)
+
+
 # Flask routes
 @app.route('/')
 def index():
     """Main page"""
-    return render_template('gamepad_control.html')
+    return Response(INDEX_HTML, mimetype='text/html')
 
 
 @app.route('/api/status')
 def api_status():
     """Get current status"""
-    return jsonify(state)
+    return Response(state_bytes, mimetype='application/json')
+
+
+def _limited_stream(slots, generate, **kwargs):
+    """Stream generate() while holding one of slots, or answer 503
+
+    The slot is released when the server closes the response, whether or
+    not the generator ever started.
+    """
+    if not slots.acquire(blocking=False):
+        return Response('Too many viewers', status=503, mimetype='text/plain')
+    # The generator already yields bytes; let them go to the server as-is
+    return Response(ClosingIterator(generate(), slots.release),
+                    direct_passthrough=True, **kwargs)
+
+
+def generate_status_stream():
+    """Generate server-sent events carrying the status JSON on each change"""
+    seq = -1  # Send the current state straight away
+    while True:
+        with state_cond:
+            changed = state_cond.wait_for(lambda: state_seq > seq, STATE_KEEPALIVE_INTERVAL)
+            seq, data = state_seq, state_bytes
+
+        if changed:
+            yield b'data: ' + data + b'\n\n'
+        else:
+            # Nothing changed; a comment lets a dead connection show up
+            yield b': keepalive\n\n'
+
+
+@app.route('/api/status/stream')
+def api_status_stream():
+    """Push status updates as they happen"""
+    return _limited_stream(status_stream_slots, generate_status_stream,
+                           mimetype='text/event-stream',
+                           headers={'Cache-Control': 'no-cache'})
 
 
 @app.route('/api/photos/<side>')
@@ -338,12 +887,9 @@ def api_photos(side):
     if side not in ['left', 'right']:
         return jsonify({'error': 'Invalid side'}), 400
 
-    photo_dir = left_dir if side == 'left' else right_dir
-    if not os.path.exists(photo_dir):
-        return jsonify({'photos': []})
-
-    photos = sorted([f for f in os.listdir(photo_dir) if f.endswith('.jpg')], reverse=True)
-    return jsonify({'photos': photos[:50]})  # Return latest 50
+    with photos_lock:
+        latest = list(itertools.islice(photos[side], 50))  # Return latest 50
+    return jsonify({'photos': latest})
 
 
 @app.route('/photos/<side>/<filename>')
@@ -370,11 +916,13 @@ def api_delete_photo(side, filename):
 
     try:
         os.remove(file_path)
-        # Update counters
-        if side == 'left':
-            state['left_count'] = max(0, state['left_count'] - 1)
-        else:
-            state['right_count'] = max(0, state['right_count'] - 1)
+        # Update photo list and counter
+        with photos_lock:
+            try:
+                photos[side].remove(filename)
+            except ValueError:
+                pass
+            state[f'{side}_count'] = len(photos[side])
         return jsonify({'status': 'deleted', 'filename': filename})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -392,19 +940,20 @@ def api_delete_all_photos(side):
 
     try:
         count = 0
-        for filename in os.listdir(photo_dir):
-            if filename.endswith('.jpg'):
-                os.remove(os.path.join(photo_dir, filename))
-                count += 1
-
-        # Reset counter
-        if side == 'left':
-            state['left_count'] = 0
-        else:
-            state['right_count'] = 0
+        with os.scandir(photo_dir) as it:
+            for entry in it:
+                if entry.name.endswith('.jpg'):
+                    os.remove(entry.path)
+                    count += 1
+
+        # Reset photo list and counter
+        with photos_lock:
+            photos[side].clear()
+            state[f'{side}_count'] = 0
 
         return jsonify({'status': 'deleted', 'count': count})
     except Exception as e:
+        _load_photos(side, photo_dir)  # Some photos may be left, resync
         return jsonify({'error': str(e)}), 500
 
 
@@ -416,44 +965,54 @@ def api_shutdown():
 
 
 def generate_video_feed():
-    """Generate video frames for MJPEG stream"""
-    while True:
-        if global_camera is None:
-            time.sleep(0.1)
-            continue
-
-        frame = global_camera.get_frame()
-        if frame is None:
-            time.sleep(0.1)
-            continue
+    """Generate video frames for MJPEG stream
+
+    Each client always gets the newest frame; a client that is slow to
+    receive skips frames instead of holding up the camera or other clients.
+
+    The stream ends if there is no camera. While the camera is stalled the
+    last frame is re-sent every second, so a client that has gone away is
+    noticed and its server thread freed.
+    """
+    give_up = time.monotonic() + VIDEO_START_TIMEOUT
+    while global_camera is None:
+        if time.monotonic() > give_up:
+            return  # Control loop never got as far as the camera
+        time.sleep(0.1)
+    camera = global_camera
+    if not state['camera_available']:
+        return
 
-        # Encode frame as JPEG
-        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
-        if not ret:
+    seq = 0
+    frame_bytes = None
+    while True:
+        # Sleep until the camera publishes a frame this client hasn't seen
+        latest = camera.wait_frame(seq, timeout=1.0)
+        if latest is not None:
+            seq = latest
+            # Already encoded by the pipeline when nvjpegenc is available
+            frame_bytes = camera.get_jpeg() or frame_bytes
+
+        if frame_bytes is None:
+            if time.monotonic() > give_up:
+                return  # Camera never produced a frame
             continue
 
-        frame_bytes = buffer.tobytes()
-
-        # Yield frame in MJPEG format
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-
-        time.sleep(0.033)  # ~30 fps
+        # Yield frame in MJPEG format, without copying the JPEG into a new buffer
+        yield MJPEG_HDR
+        yield frame_bytes
+        yield MJPEG_TAIL
 
 
 @app.route('/video_feed')
 def video_feed():
     """Video streaming route"""
-    return Response(generate_video_feed(),
-                    mimetype='multipart/x-mixed-replace; boundary=frame')
-
+    return _limited_stream(video_feed_slots, generate_video_feed,
+                           mimetype='multipart/x-mixed-replace; boundary=frame')
 
-def create_html_template():
-    """Create the HTML template file"""
-    template_dir = os.path.join(os.path.dirname(__file__), 'templates')
-    os.makedirs(template_dir, exist_ok=True)
 
-    html_content = '''<!DOCTYPE html>
+# Main page, served as-is from memory
+INDEX_HTML = '''<!DOCTYPE html>
 <html>
 <head>
     <title>JetBot Gamepad Control</title>
@@ -661,46 +1220,48 @@ def create_html_template():
         function updateStatus() {
             fetch('/api/status')
                 .then(r => r.json())
-                .then(data => {
-                    document.getElementById('gamepad-status').innerHTML =
-                        data.gamepad_connected ?
-                        `<span class="connected">✓ ${data.gamepad_name}</span>` :
-                        '<span class="disconnected">✗ Not connected</span>';
-
-                    document.getElementById('camera-status').innerHTML =
-                        data.camera_available ?
-                        '<span class="connected">✓ Ready</span>' :
-                        '<span class="disconnected">✗ Not available</span>';
-
-                    document.getElementById('left-count').textContent = data.left_count;
-                    document.getElementById('right-count').textContent = data.right_count;
-                    document.getElementById('message').textContent = data.message;
-
-                    // Update motor visualizations
-                    const leftPct = Math.abs(data.left_motor) * 100;
-                    const rightPct = Math.abs(data.right_motor) * 100;
-                    const leftBar = document.getElementById('left-motor-bar');
-                    const rightBar = document.getElementById('right-motor-bar');
-
-                    leftBar.style.height = leftPct + '%';
-                    rightBar.style.height = rightPct + '%';
-
-                    // Add/remove negative class for color change
-                    if (data.left_motor < 0) {
-                        leftBar.classList.add('negative');
-                    } else {
-                        leftBar.classList.remove('negative');
-                    }
-
-                    if (data.right_motor < 0) {
-                        rightBar.classList.add('negative');
-                    } else {
-                        rightBar.classList.remove('negative');
-                    }
+                .then(showStatus);
+        }
 
-                    document.getElementById('left-motor-val').textContent = data.left_motor.toFixed(2);
-                    document.getElementById('right-motor-val').textContent = data.right_motor.toFixed(2);
-                });
+        function showStatus(data) {
+            document.getElementById('gamepad-status').innerHTML =
+                data.gamepad_connected ?
+                `<span class="connected">✓ ${data.gamepad_name}</span>` :
+                '<span class="disconnected">✗ Not connected</span>';
+
+            document.getElementById('camera-status').innerHTML =
+                data.camera_available ?
+                '<span class="connected">✓ Ready</span>' :
+                '<span class="disconnected">✗ Not available</span>';
+
+            document.getElementById('left-count').textContent = data.left_count;
+            document.getElementById('right-count').textContent = data.right_count;
+            document.getElementById('message').textContent = data.message;
+
+            // Update motor visualizations
+            const leftPct = Math.abs(data.left_motor) * 100;
+            const rightPct = Math.abs(data.right_motor) * 100;
+            const leftBar = document.getElementById('left-motor-bar');
+            const rightBar = document.getElementById('right-motor-bar');
+
+            leftBar.style.height = leftPct + '%';
+            rightBar.style.height = rightPct + '%';
+
+            // Add/remove negative class for color change
+            if (data.left_motor < 0) {
+                leftBar.classList.add('negative');
+            } else {
+                leftBar.classList.remove('negative');
+            }
+
+            if (data.right_motor < 0) {
+                rightBar.classList.add('negative');
+            } else {
+                rightBar.classList.remove('negative');
+            }
+
+            document.getElementById('left-motor-val').textContent = data.left_motor.toFixed(2);
+            document.getElementById('right-motor-val').textContent = data.right_motor.toFixed(2);
         }
 
         function deletePhoto(side, filename) {
@@ -746,8 +1307,31 @@ def create_html_template():
                 });
         }
 
-        // Update status every 500ms (reduced from 100ms to minimize logs)
-        setInterval(updateStatus, 500);
+        // Status is pushed by the server as it changes; poll every 500ms
+        // if the browser or server can't stream it
+        let statusTimer = null;
+        function pollStatus() {
+            if (statusTimer === null) {
+                statusTimer = setInterval(updateStatus, 500);
+            }
+        }
+
+        if (window.EventSource) {
+            const statusStream = new EventSource('/api/status/stream');
+            let statusOpened = false;
+            statusStream.onopen = () => { statusOpened = true; };
+            statusStream.onmessage = e => showStatus(JSON.parse(e.data));
+            statusStream.onerror = () => {
+                // Once the stream has worked, EventSource reconnects by
+                // itself (e.g. after a server restart)
+                if (!statusOpened) {
+                    statusStream.close();
+                    pollStatus();
+                }
+            };
+        } else {
+            pollStatus();
+        }
 
         // Update photos every 3 seconds
         setInterval(() => {
@@ -761,10 +1345,7 @@ def create_html_template():
         loadPhotos('right');
     </script>
 </body>
-</html>'''
-
-    with open(os.path.join(template_dir, 'gamepad_control.html'), 'w') as f:
-        f.write(html_content)
+</html>'''.encode('utf-8')
 
 
 def main():
@@ -772,14 +1353,24 @@ def main():
     print("JetBot Gamepad Control with Web Interface")
     print("=" * 50)
 
-    # Create HTML template
-    create_html_template()
+    log_listener = _start_logging()
+
+    # Load existing photos before anything else, so the gallery works even
+    # when no gamepad is connected
+    os.makedirs(left_dir, exist_ok=True)
+    os.makedirs(right_dir, exist_ok=True)
+    _load_photos('left', left_dir)
+    _load_photos('right', right_dir)
+    print(f"Found {state['left_count']} left photos, {state['right_count']} right photos")
 
     # Disable Flask's default request logging to reduce spam
-    import logging
     log = logging.getLogger('werkzeug')
     log.setLevel(logging.ERROR)
 
+    # Keep the status JSON encoded once for all clients
+    encoder_thread = threading.Thread(target=state_encoder_loop, daemon=True)
+    encoder_thread.start()
+
     # Start robot control in separate thread
     control_thread = threading.Thread(target=robot_control_loop, daemon=True)
     control_thread.start()
@@ -797,8 +1388,22 @@ def main():
     print(f"  http://localhost:5000")
     print("\nPress Ctrl+C to stop\n")
 
-    # Start Flask server
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    # Start web server. waitress serves each client from its own worker
+    # thread, so video streams don't block status polling
+    try:
+        from waitress import serve
+    except ImportError:
+        serve = None
+
+    try:
+        if serve is None:
+            print("waitress not installed, falling back to the Flask development server")
+            app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
+        else:
+            serve(app, host='0.0.0.0', port=5000, threads=WEB_THREADS,
+                  outbuf_high_watermark=WEB_OUTBUF_HIGH_WATERMARK)
+    finally:
+        log_listener.stop()
 
 
 if __name__ == "__main__":